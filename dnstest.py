@@ -2,18 +2,30 @@
 # -*- coding: utf-8 -*-
 
 import os
+import math
 import sys
 import time
-import ipaddress
+import random
+import socket
+import struct
+import asyncio
+import re
 import threading
 import requests
+import numpy as np
 import pandas as pd  # pip install pandas openpyxl
-import dns.resolver  # pip install dnspython
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm  # pip install tqdm
 from typing import Optional, Dict, Any, List
 import openpyxl
-from openpyxl.styles import PatternFill
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill
+from openpyxl.utils import get_column_letter
+
+# 仅Unix提供，用于读取文件描述符上限
+try:
+    import resource
+except ImportError:
+    resource = None
 
 # 可选：pip install maxminddb
 try:
@@ -25,6 +37,27 @@ except ImportError:
 # 默认 DNS 列表 URL
 DEFAULT_URL = "https://public-dns.info/nameservers.txt"
 
+# 存活探测查询的域名（根服务器地址，几乎所有递归DNS都已缓存）
+LIVENESS_DOMAIN = "a.root-servers.net"
+LIVENESS_ATTEMPTS = 2
+
+# UDP通道池：每个socket分摊的在途查询上限（过多易因接收缓冲溢出丢包）、
+# 接收缓冲大小（受系统上限约束）、为其他用途预留的文件描述符数
+SOCKET_INFLIGHT = 64
+CHANNEL_RCVBUF = 1024 * 1024
+FD_RESERVE = 64
+
+# 成功率需超过该值才进入污染检测
+最低成功率 = 0.4
+
+# 污染检测时交叉比对的参考DNS（DoH，不受UDP抢答污染影响），结果缓存秒数
+REFERENCE_RESOLVERS = [
+    "https://cloudflare-dns.com/dns-query",
+    "https://dns.google/dns-query",
+    "https://dns.quad9.net/dns-query",
+]
+REFERENCE_TTL = 60
+
 # 默认测试域名
 TEST_DOMAINS = [
     "google.com", "facebook.com", "amazon.com", "microsoft.com",
@@ -47,10 +80,36 @@ def 加载_ip_mmdb_db(mmdb_file: str = "ip.mmdb") -> Optional[maxminddb.Reader]:
 _ip_mmdb_reader = None
 _ip_mmdb_lock = threading.Lock()
 
+# 组织名关键词（"google" 已覆盖 "google llc" / "google cloud" 等）
+GOOGLE_KEYWORDS = ('google', 'alphabet', 'gcp')
+ORG_FIELDS = ('autonomous_system_organization', 'organization', 'isp')
+
+# 已判定过的IP：重复出现时直接集合命中，不再查MMDB
+_GOOGLE_IPS: set = set()
+_NOT_GOOGLE_IPS: set = set()
+
+def _查询_mmdb(ip: str) -> bool:
+    """查MMDB并按组织名判断"""
+    try:
+        response = _ip_mmdb_reader.get(ip)
+        if not response:
+            return False
+        
+        # 纯组织名模糊匹配，命中即返回
+        return any(k in s for s in (str(response.get(f, '') or '').lower() for f in ORG_FIELDS)
+                   for k in GOOGLE_KEYWORDS)
+    except:
+        return False
+
 def 检查_google_ip(ip: str) -> bool:
     """仅按组织名判断Google归属"""
     global _ip_mmdb_reader
     
+    if ip in _GOOGLE_IPS:
+        return True
+    if ip in _NOT_GOOGLE_IPS:
+        return False
+    
     if _ip_mmdb_reader is None:
         with _ip_mmdb_lock:
             if _ip_mmdb_reader is None:
@@ -59,66 +118,24 @@ def 检查_google_ip(ip: str) -> bool:
     if _ip_mmdb_reader is None:
         return False
     
-    try:
-        response = _ip_mmdb_reader.get(ip)
-        if not response:
-            return False
-        
-        # 纯组织名模糊匹配
-        org_fields = ['autonomous_system_organization', 'organization', 'isp']
-        org_text = ' '.join(str(response.get(f, '') or '').lower() for f in org_fields)
-        
-        google_keywords = ['google', 'google llc', 'google cloud', 'google.com', 'alphabet', 'gcp']
-        return any(keyword in org_text for keyword in google_keywords)
-    except:
-        return False
+    is_google = _查询_mmdb(ip)
+    (_GOOGLE_IPS if is_google else _NOT_GOOGLE_IPS).add(ip)
+    return is_google
 
-def 创建干净_resolver(dns_server: str, timeout: float = 3.0):
-    """创建全新无缓存Resolver"""
-    resolver = dns.resolver.Resolver(configure=False)  # 禁用系统配置
-    resolver.nameservers = [dns_server]
-    resolver.timeout = timeout
-    resolver.lifetime = timeout
-    resolver.cache = None  # 强制禁用缓存
-    return resolver
-
-def 终极污染检测(dns_server: str, benchmark_ips: List[str]) -> str:
-    """🔥 5次独立无缓存验证"""
-    #print(f"\n🔍 检测 {dns_server}")
-    #print(f"基准IP: {benchmark_ips[:3]}")
-    
-    # 基准IP检查
-    for i, ip in enumerate(benchmark_ips[:3]):
-        if not 检查_google_ip(ip):
-            #print(f"  ❌ 基准[{i+1}]污染: {ip}")
-            return "已污染"
-    
-    # 5次全新无缓存解析
-    #print("5次独立无缓存验证...")
-    纯净次数 = 0
-    
-    for i in range(5):
-        resolver = 创建干净_resolver(dns_server)
+# IPv4按字符串形状精确匹配(每段0-255、无前导0，仅ASCII数字)；含':'的再交给inet_pton校验IPv6
+IPV4_RE = re.compile(r'((25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)\.){3}(25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)', re.ASCII)
+
+def 识别_ip版本(token: str) -> Optional[str]:
+    """返回 "4" / "6"，非IP返回None"""
+    if IPV4_RE.fullmatch(token):
+        return "4"
+    if ':' in token:
         try:
-            start = time.perf_counter()
-            answers = resolver.resolve("google.com", "A")
-            ips = [str(rdata) for rdata in answers]
-            latency = (time.perf_counter() - start) * 1000
-            
-            #print(f"  [{i+1}] {latency:.0f}ms: {ips[:2]}")
-            
-            if all(检查_google_ip(ip) for ip in ips):
-                纯净次数 += 1
-            else:
-                #print(f"  ❌ [{i+1}]污染IP: {ips}")
-                return "已污染"
-        except Exception as e:
-            #print(f"  ❌ [{i+1}]失败: {e}")
-            return "已污染"
-    
-    result = "未污染" if 纯净次数 == 5 else "已污染"
-    #print(f"✅ {纯净次数}/5 → {result}")
-    return result
+            socket.inet_pton(socket.AF_INET6, token)
+            return "6"
+        except (OSError, ValueError):
+            return None
+    return None
 
 def 读取_dns列表(url: str):
     """读取DNS列表"""
@@ -132,12 +149,9 @@ def 读取_dns列表(url: str):
         line = line.strip()
         if not line: continue
         for part in line.split():
-            try:
-                ipaddress.ip_address(part)
+            if 识别_ip版本(part):
                 dns_list.append(part)
                 break
-            except ValueError:
-                continue
     print(f"共{len(dns_list)}个DNS")
     return dns_list
 
@@ -145,96 +159,439 @@ def 按IP版本过滤(dns_list, mode: str):
     """IP版本过滤"""
     v4, v6 = [], []
     for ip_str in dns_list:
-        try:
-            ip = ipaddress.ip_address(ip_str)
-            (v4 if isinstance(ip, ipaddress.IPv4Address) else v6).append(ip_str)
-        except:
-            continue
+        version = 识别_ip版本(ip_str)
+        if version == "4":
+            v4.append(ip_str)
+        elif version == "6":
+            v6.append(ip_str)
     return v4 if mode == "4" else v6 if mode == "6" else v4 + v6
 
-_thread_local = threading.local()
-
-def 获取_resolver(dns_server: str, timeout_sec: float):
-    """线程本地Resolver"""
-    if not hasattr(_thread_local, "resolvers"):
-        _thread_local.resolvers = {}
-    key = (dns_server, timeout_sec)
-    if key not in _thread_local.resolvers:
-        r = dns.resolver.Resolver()
-        r.nameservers = [dns_server]
-        r.timeout = timeout_sec
-        r.lifetime = timeout_sec
-        _thread_local.resolvers[key] = r
-    return _thread_local.resolvers[key]
-
-def 执行_dns查询(domain: str, dns_server: str, record_type: str, timeout_sec: float):
-    """单次DNS查询"""
-    start = time.perf_counter()
-    try:
-        resolver = 获取_resolver(dns_server, timeout_sec)
-        answers = resolver.resolve(domain, record_type)
-        ip_list = [str(rdata) for rdata in answers]
-        return True, (time.perf_counter() - start) * 1000, ip_list
-    except:
-        return False, (time.perf_counter() - start) * 1000, []
+# 精简DNS客户端：仅构造/解析 A、AAAA 查询
+QTYPES = {"A": 1, "AAAA": 28}
+
+def 编码_qname(domain: str) -> bytes:
+    """域名转DNS线格式"""
+    return b''.join(bytes([len(label)]) + label
+                    for label in domain.rstrip('.').encode('idna').split(b'.')) + b'\0'
+
+def 构造_查询(txid: int, qname_wire: bytes, qtype: int) -> bytes:
+    """12字节头(RD=1, QDCOUNT=1) + QNAME + QTYPE/QCLASS"""
+    return struct.pack('!HHHHHH', txid, 0x0100, 1, 0, 0, 0) + qname_wire + struct.pack('!HH', qtype, 1)
+
+def 预构造_查询(domains) -> Dict[str, List[bytes]]:
+    """启动时为每个(域名, 记录类型)构造一次完整报文，发送时只改写txid"""
+    return {rtype: [构造_查询(0, 编码_qname(d), qtype) for d in domains]
+            for rtype, qtype in QTYPES.items()}
+
+def _跳过_name(data: bytes, pos: int) -> int:
+    """跳过(可能压缩的)域名，返回其后位置"""
+    while True:
+        length = data[pos]
+        if length == 0:
+            return pos + 1
+        if length & 0xC0 == 0xC0:  # 压缩指针，占2字节且为结尾
+            return pos + 2
+        pos += length + 1
+
+def 解析_应答(data: bytes, qtype: int) -> List[str]:
+    """只解析应答段中的 A/AAAA 记录，RCODE非0或无记录时抛异常"""
+    _, flags, qdcount, ancount, _, _ = struct.unpack_from('!HHHHHH', data)
+    if flags & 0x000F:
+        raise ValueError(f"rcode={flags & 0x000F}")
+    pos = 12
+    for _ in range(qdcount):
+        pos = _跳过_name(data, pos) + 4
+    
+    family, size = (socket.AF_INET, 4) if qtype == 1 else (socket.AF_INET6, 16)
+    ips = []
+    for _ in range(ancount):
+        pos = _跳过_name(data, pos)
+        rtype, _, _, rdlen = struct.unpack_from('!HHIH', data, pos)
+        pos += 10
+        if rtype == qtype and rdlen == size:
+            ips.append(socket.inet_ntop(family, data[pos:pos + size]))
+        pos += rdlen
+    if not ips:
+        raise ValueError("no answer")
+    return ips
 
-def 测试单个dns(dns_server: str, domains, ip_mode: str, timeout_sec: float, 
-                延迟下限_ms: float, 开启污染检查: bool):
-    """测试单个DNS"""
-    总次数, 成功次数, 延迟列表, domain_ips = 0, 0, [], {}
+class DNS通道(asyncio.DatagramProtocol):
+    """单个UDP端点（跨DNS复用），按(txid, 源地址)分发应答，可同时挂起多个查询
+    基于create_datagram_endpoint，Selector与Windows的Proactor事件循环均可用"""
+    
+    def __init__(self, family: int):
+        self.family = family
+        self.loop = asyncio.get_running_loop()
+        self.pending: Dict[tuple, asyncio.Future] = {}
+        self.transport: Optional[asyncio.DatagramTransport] = None
+    
+    @classmethod
+    async def 创建(cls, family: int, rcvbuf: Optional[int] = None) -> "DNS通道":
+        """绑定临时端口；失败时由事件循环关闭socket并抛出异常"""
+        local_addr = ('::', 0) if family == socket.AF_INET6 else ('0.0.0.0', 0)
+        transport, channel = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: cls(family), local_addr=local_addr, family=family)
+        if rcvbuf:
+            try:
+                # 尽量调大接收缓冲（系统上限内），减少突发应答被丢弃
+                transport.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+            except OSError:
+                pass
+        return channel
+    
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def datagram_received(self, data: bytes, addr):
+        # 丢弃过短或非应答(QR=0)的报文
+        if len(data) < 12 or not data[2] & 0x80:
+            return
+        try:
+            key = (struct.unpack_from('!H', data)[0], socket.inet_pton(self.family, addr[0]))
+        except OSError:
+            return
+        future = self.pending.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result((data, time.perf_counter()))
+    
+    def error_received(self, exc):
+        """ICMP不可达等错误无法对应到具体查询，交给超时处理"""
+    
+    async def burst(self, dns_server: str, query_wires: List[bytes], qtype: int, timeout_sec: float) -> List[tuple]:
+        """连续发出全部查询(各自不同txid)后边收边解析，返回每个查询的(成功, 延迟ms, IP列表)"""
+        addr = socket.inet_pton(self.family, dns_server)
+        keys, futures, sent = [], [], []
+        results: List[Optional[tuple]] = [None] * len(query_wires)
+        try:
+            for wire in query_wires:
+                txid = random.getrandbits(16)
+                while (txid, addr) in self.pending:
+                    txid = random.getrandbits(16)
+                keys.append((txid, addr))
+                future = self.pending[keys[-1]] = self.loop.create_future()
+                futures.append(future)
+                sent.append(time.perf_counter())
+                try:
+                    self.transport.sendto(struct.pack('!H', txid) + wire[2:], (dns_server, 53))
+                except OSError:
+                    future.set_result((None, time.perf_counter()))
+            
+            index = {future: i for i, future in enumerate(futures)}
+            waiting = set(futures)
+            deadline = self.loop.time() + timeout_sec
+            while waiting:
+                done, waiting = await asyncio.wait(waiting, timeout=deadline - self.loop.time(),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    i = index[future]
+                    data, received = future.result()
+                    latency = (received - sent[i]) * 1000
+                    try:
+                        results[i] = (True, latency, 解析_应答(data, qtype))
+                    except Exception:
+                        results[i] = (False, latency, [])
+        finally:
+            for key in keys:
+                self.pending.pop(key, None)
+        
+        # 超时仍未收到应答的按失败计，延迟即已等待时长
+        now = time.perf_counter()
+        return [r if r is not None else (False, (now - t0) * 1000, [])
+                for r, t0 in zip(results, sent)]
     
+    def close(self):
+        self.transport.close()
+
+def 地址族(dns_server: str) -> int:
+    return socket.AF_INET6 if ':' in dns_server else socket.AF_INET
+
+async def 打开_通道(families, rcvbuf: Optional[int] = None) -> Dict[int, DNS通道]:
+    """为每个地址族创建一个通道；任一创建失败则关闭已建的并抛出"""
+    channels: Dict[int, DNS通道] = {}
     try:
-        是IPv4 = isinstance(ipaddress.ip_address(dns_server), ipaddress.IPv4Address)
-    except:
-        是IPv4 = True
-    
-    for domain in domains:
-        rtype = "A" if ip_mode != "6" and (ip_mode == "4" or 是IPv4) else "AAAA"
-        总次数 += 1
-        ok, latency, ips = 执行_dns查询(domain, dns_server, rtype, timeout_sec)
-        domain_ips[domain] = ips
-        
-        if latency is not None and latency < 延迟下限_ms:
-            return None
+        for family in families:
+            channels[family] = await DNS通道.创建(family, rcvbuf)
+    except BaseException:
+        for channel in channels.values():
+            channel.close()
+        raise
+    return channels
+
+def 获取_通道(channels: Dict[int, DNS通道], dns_server: str) -> DNS通道:
+    """取对应地址族的通道（由并发执行预先创建）"""
+    return channels[地址族(dns_server)]
+
+async def 测试单个dns(channels: Dict[int, DNS通道], dns_server: str, domains,
+                    wires: Dict[str, List[bytes]], ip_mode: str, timeout_sec: float):
+    """测试单个DNS（全部域名流水线解析），只返回原始延迟/成功标记，统计留给汇总阶段"""
+    是IPv4 = ':' not in dns_server  # 列表已经过识别_ip版本筛选
+    rtype = "A" if ip_mode != "6" and (ip_mode == "4" or 是IPv4) else "AAAA"
+    
+    # 全部域名一次性突发发出，约1个RTT收齐，而非逐个等待；共用一个截止时间
+    channel = 获取_通道(channels, dns_server)
+    results = await channel.burst(dns_server, wires[rtype], QTYPES[rtype], timeout_sec)
+    
+    ok = np.fromiter((r[0] for r in results), dtype=bool, count=len(results))
+    latencies = np.fromiter((r[1] for r in results), dtype=np.float64, count=len(results))
+    google_ips = dict(zip(domains, (r[2] for r in results))).get("google.com", [])
+    return dns_server, latencies, ok, google_ips
+
+def 规划_通道池(concurrency: int, 每项查询数: int, family数: int) -> tuple:
+    """按在途查询总量确定socket池大小（受fd软上限约束）与worker数，返回(池大小, worker数)"""
+    池大小 = math.ceil(concurrency * 每项查询数 / SOCKET_INFLIGHT)
+    if resource is not None:
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY:
+            池大小 = min(池大小, (soft - FD_RESERVE) // family数)
+    池大小 = max(1, 池大小)
+    # fd不够时减少worker，保证每个socket的在途查询不超过SOCKET_INFLIGHT
+    worker数 = max(1, min(concurrency, 池大小 * SOCKET_INFLIGHT // 每项查询数))
+    return 池大小, worker数
+
+async def 并发执行(items: list, handler, concurrency: int, desc: str, families,
+                  每项查询数: int) -> list:
+    """固定数量worker协程共享任务列表，按轮询共用一个有界的UDP通道池
+    单个任务的网络/解析异常记为None；通道创建失败直接抛出，中止整个阶段"""
+    results = [None] * len(items)
+    pending = iter(enumerate(items))
+    完成数 = 0
+    池大小, worker数 = 规划_通道池(concurrency, 每项查询数, max(1, len(families)))
+    
+    pool: List[Dict[int, DNS通道]] = []
+    try:
+        for _ in range(池大小):
+            pool.append(await 打开_通道(families, rcvbuf=CHANNEL_RCVBUF))
+    except BaseException:
+        for channels in pool:
+            for channel in channels.values():
+                channel.close()
+        raise
+    
+    async def worker(channels: Dict[int, DNS通道]):
+        nonlocal 完成数
+        for i, item in pending:
+            try:
+                results[i] = await handler(channels, item)
+            except Exception:
+                pass
+            完成数 += 1
+    
+    async def 刷新进度():
+        """定时批量刷新进度条，避免每个任务完成都触发一次tqdm更新"""
+        while True:
+            await asyncio.sleep(0.2)
+            pbar.update(完成数 - pbar.n)
+    
+    with tqdm(total=len(items), desc=desc, unit="DNS") as pbar:
+        ticker = asyncio.create_task(刷新进度())
+        try:
+            await asyncio.gather(*(worker(pool[k % 池大小])
+                                   for k in range(min(worker数, len(items)))))
+        finally:
+            ticker.cancel()
+            for channels in pool:
+                for channel in channels.values():
+                    channel.close()
+        pbar.update(完成数 - pbar.n)
+    return results
+
+async def 存活探测(channels: Dict[int, DNS通道], dns_server: str, wire: bytes, timeout_sec: float) -> bool:
+    """单个查询探测DNS是否能正常应答，无应答时重试一次再判定失效"""
+    channel = 获取_通道(channels, dns_server)
+    for _ in range(LIVENESS_ATTEMPTS):
+        (ok, _, _), = await channel.burst(dns_server, [wire], QTYPES["A"], timeout_sec)
         if ok:
-            成功次数 += 1
-            延迟列表.append(latency)
-    
-    if 总次数 == 0 or not 延迟列表:
+            return True
+    return False
+
+async def 过滤存活dns(dns_list, timeout_sec: float, concurrency: int) -> List[str]:
+    """每个DNS只发1个查询，剔除无应答/拒绝解析的DNS"""
+    wire = 构造_查询(0, 编码_qname(LIVENESS_DOMAIN), QTYPES["A"])
+    results = await 并发执行(dns_list, lambda channels, d: 存活探测(channels, d, wire, timeout_sec),
+                             concurrency, "存活探测", {地址族(d) for d in dns_list}, 每项查询数=1)
+    return [d for d, alive in zip(dns_list, results) if alive]
+
+async def 基准测试(dns_list, domains, ip_mode: str, timeout_sec: float, concurrency: int):
+    """先存活探测，再对存活DNS在单个事件循环内并发测试"""
+    # 探测与基准使用相同并发，不按域名数放大：在途查询过多时应答会被丢弃，误判存活DNS
+    dns_list = await 过滤存活dns(dns_list, timeout_sec, concurrency)
+    print(f"存活: {len(dns_list)}个DNS")
+    
+    wires = 预构造_查询(domains)
+    results = await 并发执行(
+        dns_list, lambda channels, d: 测试单个dns(channels, d, domains, wires, ip_mode, timeout_sec),
+        concurrency, "基准测试", {地址族(d) for d in dns_list}, 每项查询数=len(domains))
+    return [r for r in results if r is not None]
+
+def 随机大小写(domain: str) -> str:
+    """0x20编码：随机化域名大小写"""
+    return ''.join(random.choice((c.upper(), c.lower())) for c in domain)
+
+async def 无缓存解析_google(channel: DNS通道, dns_server: str, timeout: float = 3.0) -> Optional[List[str]]:
+    """经通道解析一次google.com（无缓存），失败返回None"""
+    # 随机QNAME大小写(0x20)绕过上游缓存
+    wire = 构造_查询(0, 编码_qname(随机大小写("google.com")), QTYPES["A"])
+    try:
+        (ok, _, ips), = await channel.burst(dns_server, [wire], QTYPES["A"], timeout)
+        return ips if ok else None
+    except Exception as e:
+        #print(f"  ❌ 失败: {e}")
         return None
+
+# 全局DoH Session（模块加载时创建，多个to_thread线程共用同一连接池）
+_doh_session = requests.Session()
+_doh_session.headers.update({"Content-Type": "application/dns-message",
+                             "Accept": "application/dns-message"})
+
+def doh_查询_google(url: str, timeout: float = 3.0) -> List[str]:
+    """RFC 8484 POST查询google.com；全局Session保持长连接，失败返回空列表"""
+    try:
+        # DoH建议txid固定为0
+        wire = 构造_查询(0, 编码_qname("google.com"), QTYPES["A"])
+        resp = _doh_session.post(url, data=wire, timeout=timeout)
+        resp.raise_for_status()
+        return 解析_应答(resp.content, QTYPES["A"])
+    except Exception:
+        return []
+
+class 参考DNS:
+    """参考DNS应答在TTL内由全部候选共享，过期后再经复用的HTTPS连接刷新"""
+    
+    def __init__(self, ttl: float = REFERENCE_TTL):
+        self.ttl = ttl
+        self.future: Optional[asyncio.Future] = None
+        self.expire = 0.0
+    
+    def 获取(self) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        if self.future is None or loop.time() > self.expire:
+            self.future = asyncio.ensure_future(self._查询())
+            self.expire = loop.time() + self.ttl
+        return self.future
+    
+    async def _查询(self) -> set:
+        results = await asyncio.gather(*(asyncio.to_thread(doh_查询_google, url)
+                                         for url in REFERENCE_RESOLVERS))
+        return set().union(*results)
+
+async def 终极污染检测(channels: Dict[int, DNS通道], dns_server: str, benchmark_ips: List[str],
+                      参考: 参考DNS) -> str:
+    """🔥 5次并发无缓存验证 + 参考DNS交叉比对"""
+    #print(f"\n🔍 检测 {dns_server}")
+    #print(f"基准IP: {benchmark_ips[:3]}")
+    
+    # 参考DNS与5次无缓存解析同时进行，一个RTT内即可完成判定
+    参考_future = 参考.获取()
+    channel = 获取_通道(channels, dns_server)
+    tasks = [asyncio.create_task(无缓存解析_google(channel, dns_server)) for _ in range(5)]
     
-    成功率 = 成功次数 / 总次数
-    avg = sum(延迟列表) / len(延迟列表)
-    min_d = min(延迟列表)
-    max_d = max(延迟列表)
+    async def 全部可信(ips: List[str]) -> bool:
+        """MMDB确认为Google，或出现在参考DNS的应答中"""
+        未确认 = [ip for ip in ips if not 检查_google_ip(ip)]
+        if not 未确认:
+            return True
+        return (await 参考_future).issuperset(未确认)
     
-    污染状态 = "待检测" if 开启污染检查 and 成功率 > 0.4 else "未测试"
+    try:
+        # 基准IP检查
+        if not await 全部可信(benchmark_ips[:3]):
+            #print(f"  ❌ 基准污染: {benchmark_ips[:3]}")
+            return "已污染"
+        
+        # 任一解析失败/污染即提前返回
+        for future in asyncio.as_completed(tasks):
+            ips = await future
+            if ips is None or not await 全部可信(ips):
+                #print(f"  ❌ 污染IP: {ips}")
+                return "已污染"
+    finally:
+        for task in tasks:
+            task.cancel()
     
+    #print(f"✅ 5/5 → 未污染")
+    return "未污染"
+
+async def 批量污染检测(targets: List[tuple], concurrency: int) -> List[str]:
+    """targets为(dns_server, google_ips)；检测异常按已污染处理"""
+    参考 = 参考DNS()
+    results = await 并发执行(targets, lambda channels, t: 终极污染检测(channels, *t, 参考),
+                             concurrency, "污染检测", {地址族(t[0]) for t in targets}, 每项查询数=5)
+    return [r or "已污染" for r in results]
+
+def 汇总_基准结果(原始结果, 延迟下限_ms: float, 开启污染检查: bool) -> Dict[str, np.ndarray]:
+    """每个DNS查询数相同，堆叠成(DNS数×域名数)矩阵后按行向量化统计，返回按列存放的结果"""
+    if not 原始结果:
+        return {k: np.array([], dtype=object) for k in
+                ("dns_server", "成功率", "平均延迟_ms", "最小延迟_ms", "最大延迟_ms", "dns污染", "google_ips")}
+    
+    servers, latencies, oks, google_ips = zip(*原始结果)
+    latency = np.vstack(latencies)
+    ok = np.vstack(oks)
+    
+    # 任一查询快于延迟下限（疑似本地劫持/拒绝）或全部失败的DNS剔除
+    keep = np.flatnonzero((latency.min(axis=1) >= 延迟下限_ms) & ok.any(axis=1))
+    latency, ok = latency[keep], ok[keep]
+    ok_latency = np.where(ok, latency, np.nan)
+    成功率 = ok.mean(axis=1)
+    
+    google_ips_col = np.empty(len(keep), dtype=object)
+    google_ips_col[:] = [google_ips[i] for i in keep]
     return {
-        "dns_server": dns_server, "成功率": 成功率,
-        "平均延迟_ms": avg, "最小延迟_ms": min_d, "最大延迟_ms": max_d,
-        "dns污染": 污染状态, "google_ips": domain_ips.get("google.com", [])
+        "dns_server": np.array(servers, dtype=object)[keep],
+        "成功率": 成功率,
+        "平均延迟_ms": np.nanmean(ok_latency, axis=1),
+        "最小延迟_ms": np.nanmin(ok_latency, axis=1),
+        "最大延迟_ms": np.nanmax(ok_latency, axis=1),
+        "dns污染": np.where(开启污染检查 & (成功率 > 最低成功率), "待检测", "未测试").astype(object),
+        "google_ips": google_ips_col,
     }
 
-def 设置_excel样式(output_file: str, 开启污染检查: bool):
-    """Excel美化"""
-    try:
-        wb = openpyxl.load_workbook(output_file)
-        ws = wb.active
-        for col in ws.columns:
-            let = col[0].column_letter
-            max_len = max(len(str(c.value or "")) for c in col)
-            ws.column_dimensions[let].width = min(max_len + 2, 55)
-        
-        if 开启污染检查:
-            green = PatternFill(start_color="90EE90", fill_type="solid")
-            for row in range(2, ws.max_row + 1):
-                if ws.cell(row, 6).value == "未污染":
-                    for c in range(1, ws.max_column + 1):
-                        ws.cell(row, c).fill = green
-        wb.save(output_file)
-    except:
-        pass
+# 污染状态排序名次（与原先按字符串降序一致）
+污染排序 = {"未测试": 0, "未污染": 1, "已污染": 2}
+
+def 排序索引(结果: Dict[str, np.ndarray], 开启污染检查: bool) -> np.ndarray:
+    """成功率降序 → 平均延迟升序 → 污染状态，np.lexsort以最后一个键为主键"""
+    keys = [结果["平均延迟_ms"], -结果["成功率"]]
+    if 开启污染检查:
+        keys.insert(0, np.fromiter((污染排序[v] for v in 结果["dns污染"]), dtype=np.int8,
+                                   count=len(结果["dns污染"])))
+    return np.lexsort(keys)
+
+def 导出_excel(df: pd.DataFrame, output_file: str, 开启污染检查: bool):
+    """write_only单次写出，列宽/填充随单元格一起写入（不再回读工作簿）
+    装有lxml时openpyxl会自动用其流式写XML"""
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    
+    # 构造单元格的同时统计列宽（列宽需在写入首行前设置）
+    green = PatternFill(start_color="90EE90", fill_type="solid")
+    pollute_idx = df.columns.get_loc("DNS污染") if 开启污染检查 else None
+    widths = [len(col) for col in df.columns]
+    rows = []
+    for row in df.itertuples(index=False):
+        cells = []
+        for i, v in enumerate(row):
+            widths[i] = max(widths[i], len(str(v)))
+            cells.append(WriteOnlyCell(ws, v))
+        if pollute_idx is not None and row[pollute_idx] == "未污染":
+            for c in cells:
+                c.fill = green
+        rows.append(cells)
+    for i, w in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(i)].width = min(w + 2, 55)
+    
+    bold = Font(bold=True)
+    header = []
+    for col in df.columns:
+        cell = WriteOnlyCell(ws, col)
+        cell.font = bold
+        header.append(cell)
+    ws.append(header)
+    for cells in rows:
+        ws.append(cells)
+    wb.save(output_file)
 
 def main():
     print("DNS基准测试")
@@ -257,10 +614,10 @@ def main():
     dns_list = 按IP版本过滤(dns_list, ip_mode)
     print(f"筛选: {len(dns_list)}个DNS")
     
-    # 3. 线程数
-    print("\n3) 线程:")
-    threads = int(input("线程数(1-4096,默认64): ").strip() or "64")
-    threads = max(1, min(threads, 4096))
+    # 3. 并发数（协程，非系统线程）
+    print("\n3) 并发:")
+    concurrency = int(input("并发数(1-4096,默认64): ").strip() or "64")
+    concurrency = max(1, min(concurrency, 4096))
     
     # 4. 测试域名
     print("\n4) 域名:")
@@ -280,76 +637,49 @@ def main():
     #pollute = input("选择(1/2): ").strip() or "2"
     #开启污染检查 = pollute == "1"
     pollute = 1  # 默认开启污染检查
+    开启污染检查 = pollute == 1
     
     # 7. 基准测试
     print("\n🔍 基准测试...")
-    结果列表 = []
     start_all = time.perf_counter()
     
-    with ThreadPoolExecutor(max_workers=threads) as executor:
-        futures = [executor.submit(测试单个dns, dns, test_domains, ip_mode,
-                                  per_query_timeout_sec, min_delay, pollute)
-                  for dns in dns_list]
-        
-        with tqdm(total=len(dns_list), desc="基准测试", unit="DNS") as pbar:
-            for future in as_completed(futures):
-                try:
-                    res = future.result()
-                    if res:
-                        结果列表.append(res)
-                except:
-                    pass
-                pbar.update(1)
+    原始结果 = asyncio.run(基准测试(dns_list, test_domains, ip_mode, per_query_timeout_sec, concurrency))
+    结果 = 汇总_基准结果(原始结果, min_delay, 开启污染检查)
     
-    print(f"\n✅ 基准完成: {len(结果列表)}/{len(dns_list)}有效 ({time.perf_counter()-start_all:.1f}s)")
+    print(f"\n✅ 基准完成: {len(结果['dns_server'])}/{len(dns_list)}有效 ({time.perf_counter()-start_all:.1f}s)")
     
-    if not 结果列表:
+    if not len(结果["dns_server"]):
         sys.exit(1)
     
     
     # 8. 污染检测
     if 开启污染检查:
-        candidates = [r for r in 结果列表 if r["dns污染"] == "待检测"]
-        if candidates:
+        candidates = np.flatnonzero(结果["dns污染"] == "待检测")
+        if len(candidates):
             print(f"\n🔥 检测 {len(candidates)}个候选...")
-            with ThreadPoolExecutor(max_workers=threads//4) as executor:  # 降低并发
-                futures = {executor.submit(终极污染检测, r["dns_server"], r["google_ips"]): r
-                          for r in candidates}
-                with tqdm(total=len(candidates), desc="污染检测", unit="DNS") as pbar:
-                    for future in as_completed(futures):
-                        r = futures[future]
-                        try:
-                            r["dns污染"] = future.result()
-                        except:
-                            r["dns污染"] = "已污染"
-                        pbar.update(1)
+            targets = list(zip(结果["dns_server"][candidates], 结果["google_ips"][candidates]))
+            # 每个候选同时有5个UDP查询在途（参考DNS的DoH查询全部候选共享并缓存，不计入），
+            # 按此换算并发数，使在途查询总量与基准阶段相同
+            结果["dns污染"][candidates] = asyncio.run(
+                批量污染检测(targets, max(1, concurrency * len(test_domains) // 5)))
     
     # 9. 默认状态
-    for r in 结果列表:
-        if r["dns污染"] == "待检测":
-            r["dns污染"] = "未测试"
-    
-    # 10. Excel导出
-    df = pd.DataFrame(结果列表)
-    sort_cols = ["成功率", "平均延迟_ms"]
-    if 开启污染检查:
-        df["dns污染"] = df["dns污染"].fillna("未测试")
-        sort_cols.append("dns污染")
+    结果["dns污染"][结果["dns污染"] == "待检测"] = "未测试"
     
-    df.sort_values(by=sort_cols, ascending=[False, True, False], na_position='last', inplace=True)
+    # 10. Excel导出（仅在此处构造DataFrame）
+    order = 排序索引(结果, 开启污染检查)
     
     cols = ["dns_server", "成功率", "平均延迟_ms", "最小延迟_ms", "最大延迟_ms"]
     if 开启污染检查:
         cols.append("dns污染")
-    df = df[cols].rename(columns={
+    df = pd.DataFrame({k: 结果[k][order] for k in cols}).rename(columns={
         "dns_server": "DNS服务器", "成功率": "成功率",
         "平均延迟_ms": "平均延迟(ms)", "最小延迟_ms": "最小延迟(ms)",
         "最大延迟_ms": "最大延迟(ms)", "dns污染": "DNS污染"
     })
     
     output_file = "测试结果.xlsx"
-    df.to_excel(output_file, index=False)
-    设置_excel样式(output_file, 开启污染检查)
+    导出_excel(df, output_file, 开启污染检查)
     
     print(f"\n🎉 保存: {output_file}")
     best = df.iloc[0]